@@ -12,7 +12,7 @@ setup(
     },
     packages=find_packages(exclude=['tests']),
     install_requires=["reportlab>=3.4.0",
-                      "Pillow>=4.1.0",
+                      "Pillow>=10.1.0",
                       "numpy",
                       "click"],
     url='http://domtabs.sandflea.org',
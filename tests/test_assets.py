@@ -0,0 +1,126 @@
+import os
+
+import PIL.Image
+import pytest
+
+from tuckboxes import assets
+from tuckboxes.assets import AssetIndex
+from tuckboxes.tuckboxes import TuckBoxGenerator
+
+
+@pytest.fixture
+def assetDir(tmp_path):
+    PIL.Image.new("RGB", (400, 150)).save(str(tmp_path / "a.png"))
+    PIL.Image.new("RGB", (600, 150)).save(str(tmp_path / "b.png"))
+    (tmp_path / "readme.txt").write_text("not an image")
+    return tmp_path
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    scanned = []
+    scanFile = assets.scanFile
+
+    def recordingScan(path):
+        scanned.append(os.path.basename(path))
+        return scanFile(path)
+
+    monkeypatch.setattr(assets, "scanFile", recordingScan)
+    return scanned
+
+
+def test_index_roundtrip(assetDir):
+    index = AssetIndex.load(str(assetDir))
+    assert index.update() == (3, 0)
+    index.save()
+    entry = AssetIndex.load(str(assetDir)).lookup(str(assetDir / "a.png"))
+    assert (entry["width"], entry["height"]) == (400, 150)
+    assert (entry["format"], entry["mode"]) == ("PNG", "RGB")
+    assert len(entry["sha1"]) == 40
+    assert index.lookup(str(assetDir / "readme.txt")) is None
+    assert sorted(index.images()) == ["a.png", "b.png"]
+
+
+def test_unchanged_files_are_skipped(assetDir, scans):
+    index = AssetIndex.load(str(assetDir))
+    index.update()
+    del scans[:]
+    assert index.update() == (0, 0)
+    assert scans == []
+
+
+def test_modified_file_is_rescanned(assetDir, scans):
+    index = AssetIndex.load(str(assetDir))
+    index.update()
+    del scans[:]
+    PIL.Image.new("RGB", (40, 15)).save(str(assetDir / "a.png"))
+    st = os.stat(str(assetDir / "a.png"))
+    os.utime(str(assetDir / "a.png"), (st.st_atime, st.st_mtime + 10))
+    assert index.update() == (1, 0)
+    assert scans == ["a.png"]
+    assert index.lookup(str(assetDir / "a.png"))["width"] == 40
+
+
+def test_deleted_file_is_removed(assetDir):
+    index = AssetIndex.load(str(assetDir))
+    index.update()
+    os.remove(str(assetDir / "b.png"))
+    assert index.update() == (0, 1)
+    assert "b.png" not in index.entries
+
+
+def test_broken_symlink_is_skipped(assetDir):
+    os.symlink(str(assetDir / "missing.png"), str(assetDir / "broken.png"))
+    index = AssetIndex.load(str(assetDir))
+    assert index.update() == (3, 0)
+    assert "broken.png" not in index.entries
+
+
+def test_stale_entry_is_reported(assetDir):
+    index = AssetIndex.load(str(assetDir))
+    index.update()
+    path = str(assetDir / "a.png")
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+    tuck = TuckBoxGenerator(72, 144, 36, frontImage=path)
+    [report] = tuck.preflight(index)
+    assert report.dpi is None
+    assert report.error
+
+
+def test_preflight_dpi(assetDir):
+    index = AssetIndex.load(str(assetDir))
+    index.update()
+    a = str(assetDir / "a.png")
+    b = str(assetDir / "b.png")
+    # front and back panels are 2in x 1in, the side panel 2in x 0.5in
+    stretched = TuckBoxGenerator(72, 144, 36, frontImage=b, sideImage=a)
+    preserved = TuckBoxGenerator(
+        72, 144, 36, frontImage=b, sideImage=a, preserveSideAspect=True
+    )
+    assert [(p.panel, p.dpi) for p in stretched.preflight(index)] == [
+        ("Front", 150),
+        ("Side", 200),
+    ]
+    assert [(p.panel, p.dpi) for p in preserved.preflight(index)] == [
+        ("Front", 150),
+        ("Side", 300),
+    ]
+
+
+def test_unreadable_file_is_retried(assetDir, monkeypatch):
+    pilOpen = PIL.Image.open
+    calls = []
+
+    def failOnce(path, *args, **kwargs):
+        if not calls:
+            calls.append(path)
+            raise PermissionError(path)
+        return pilOpen(path, *args, **kwargs)
+
+    monkeypatch.setattr(PIL.Image, "open", failOnce)
+    index = AssetIndex.load(str(assetDir))
+    assert index.update() == (2, 0)
+    assert os.path.relpath(calls[0], str(assetDir)) not in index.entries
+    assert index.update() == (1, 0)
+    assert sorted(index.images()) == ["a.png", "b.png"]
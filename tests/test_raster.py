@@ -0,0 +1,126 @@
+import PIL.Image
+import PIL.ImageChops
+import PIL.ImageStat
+import pytest
+from reportlab.lib.units import cm
+
+from tuckboxes.raster import RasterCanvas, dashPolyline
+from tuckboxes.tuckboxes import TuckBoxGenerator
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = {}
+    for name, colour in [("front", "red"), ("back", "blue"), ("end", "orange")]:
+        paths[name] = str(tmp_path / "{}.png".format(name))
+        PIL.Image.new("RGB", (400, 300), colour).save(paths[name])
+    paths["side"] = str(tmp_path / "side.png")
+    PIL.Image.new("RGBA", (400, 100), (0, 128, 0, 128)).save(paths["side"])
+    return paths
+
+
+def render(images, fname, fmt, dpi=72, tileSize=512):
+    tuck = TuckBoxGenerator(
+        6.4 * cm,
+        8.8 * cm,
+        3 * cm,
+        fname,
+        frontImage=images["front"],
+        backImage=images["back"],
+        sideImage=images["side"],
+        endImage=images["end"],
+        fillColour="#FFFF00",
+        outputFormat=fmt,
+        dpi=dpi,
+    )
+    tuck.canvas = RasterCanvas(fname, tuck.pagesize, dpi, fmt, tileSize=tileSize)
+    tuck.generate()
+    tuck.close()
+    return tuck
+
+
+@pytest.mark.parametrize("fmt", ["png", "tiff"])
+def test_render_formats(tmp_path, images, fmt):
+    fname = str(tmp_path / "box.{}".format(fmt))
+    tuck = render(images, fname, fmt, dpi=36)
+    with PIL.Image.open(fname) as im:
+        assert im.size == (396, 306)
+        assert im.info["dpi"] == pytest.approx((36, 36), abs=0.01)
+        im = im.convert("RGB")
+        # centre of the front panel
+        scale = 36 / 72.0
+        x = (tuck.pageMargin + tuck.depth + tuck.height / 2) * scale
+        y = (tuck.pageMargin + tuck.depth + tuck.width / 2) * scale
+        assert im.getpixel((int(x), int(306 - y))) == (255, 0, 0)
+        assert im.getpixel((2, 2)) == (255, 255, 255)
+
+
+def test_fractional_dpi(tmp_path, images):
+    fname = str(tmp_path / "box.tiff")
+    render(images, fname, "tiff", dpi=50.5)
+    with PIL.Image.open(fname) as im:
+        assert im.info["dpi"] == pytest.approx((50.5, 50.5))
+        im.load()
+
+
+@pytest.mark.parametrize("fmt", ["png", "tiff"])
+def test_tiles_match_single_tile(tmp_path, images, fmt):
+    tiled = str(tmp_path / "tiled.{}".format(fmt))
+    single = str(tmp_path / "single.{}".format(fmt))
+    render(images, tiled, fmt, tileSize=16)
+    render(images, single, fmt, tileSize=800)
+    with PIL.Image.open(tiled) as a, PIL.Image.open(single) as b:
+        assert PIL.ImageChops.difference(a, b).getbbox() is None
+
+
+def test_downscaled_art_does_not_alias(tmp_path):
+    stripes = PIL.Image.new("L", (1200, 1200))
+    stripes.putdata(
+        [0 if x % 3 == 0 else 255 for _ in range(1200) for x in range(1200)]
+    )
+    fname = str(tmp_path / "stripes.png")
+    canvas = RasterCanvas(fname, (300, 300), dpi=72, fmt="png")
+    canvas.drawImage(stripes, 0, 0, 300, 300)
+    canvas.save()
+    with PIL.Image.open(fname) as im:
+        assert PIL.ImageStat.Stat(im.convert("L")).stddev[0] < 5
+
+
+def test_dash_polyline():
+    pieces = dashPolyline([(0, 0), (10, 0), (10, 6)], (3, 5))
+    assert pieces == [
+        [(0, 0), (3, 0)],
+        [(8, 0), (10, 0), (10, 1)],
+    ]
+    assert dashPolyline([(0, 0), (1, 1)], None) == [[(0, 0), (1, 1)]]
+
+
+def test_tiles_match_single_tile_at_print_resolution(tmp_path, images):
+    renders = []
+    for tileSize in (48, 4096):
+        fname = str(tmp_path / "box{}.png".format(tileSize))
+        tuck = TuckBoxGenerator(
+            6.4 * cm,
+            8.8 * cm,
+            3 * cm,
+            fname,
+            frontImage=images["front"],
+            backImage=images["back"],
+            sideImage=images["side"],
+            endImage=images["end"],
+            preserveEndAspect=True,
+            fillColour="#FFFF00",
+        )
+        tuck.canvas = RasterCanvas(fname, tuck.pagesize, 300, "png", tileSize)
+        # the second box on a sheet is drawn rotated by 180 degrees
+        canvas = tuck.generate()
+        TuckBoxGenerator(
+            5 * cm, 6 * cm, 2 * cm, sideImage=images["side"], canvas=canvas
+        ).generate()
+        canvas.translate(300, 300)
+        canvas.rotate(30)
+        canvas.drawImage(images["front"], 0, 0, 100, 50)
+        canvas.save()
+        with PIL.Image.open(fname) as im:
+            renders.append(im.convert("RGB"))
+    assert PIL.ImageChops.difference(*renders).getbbox() is None
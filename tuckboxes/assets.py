@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+
+import PIL.Image
+
+INDEX_FILENAME = ".tuckboxes_index.json"
+
+
+def scanFile(path):
+    """Read the header and content hash of an image without decoding pixels.
+
+    Returns None for files PIL does not recognise as images. Other I/O errors,
+    such as an unreadable file, are raised so the caller can retry later.
+    """
+    entry = {}
+    try:
+        with PIL.Image.open(path) as im:
+            entry["width"], entry["height"] = im.size
+            entry["format"] = im.format
+            entry["mode"] = im.mode
+    except PIL.Image.DecompressionBombError as e:
+        entry["error"] = str(e)
+    except PIL.UnidentifiedImageError:
+        return None
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    entry["sha1"] = sha.hexdigest()
+    return entry
+
+
+class AssetIndex:
+    """Persistent header index of the images below an asset directory.
+
+    Entries are keyed by path relative to the directory and carry the file's
+    mtime and size, so update() only rescans files that changed. Files that
+    are not images are kept as entries with "image" set to False so they are
+    not reopened on every update.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, INDEX_FILENAME)
+        self.entries = {}
+
+    @staticmethod
+    def load(root):
+        index = AssetIndex(root)
+        if os.path.exists(index.path):
+            with open(index.path) as f:
+                index.entries = json.load(f)
+        return index
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def update(self):
+        """Rescan new and modified files; returns (scanned, removed) counts."""
+        seen = set()
+        scanned = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for name in filenames:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # e.g. a broken symlink
+                    continue
+                entry = self.entries.get(key)
+                if (
+                    entry is not None
+                    and entry["mtime"] == st.st_mtime
+                    and entry["bytes"] == st.st_size
+                ):
+                    seen.add(key)
+                    continue
+                try:
+                    entry = scanFile(path) or {"image": False}
+                except OSError:
+                    # not recorded, so the next update tries again
+                    continue
+                entry["mtime"] = st.st_mtime
+                entry["bytes"] = st.st_size
+                self.entries[key] = entry
+                seen.add(key)
+                scanned += 1
+        removed = set(self.entries) - seen
+        for key in removed:
+            del self.entries[key]
+        return scanned, len(removed)
+
+    def lookup(self, path):
+        """Return the entry for path, or None if it is unindexed or stale."""
+        path = os.path.abspath(path)
+        key = os.path.relpath(path, self.root)
+        entry = self.entries.get(key)
+        if entry is None or entry.get("image") is False or key.startswith(os.pardir):
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry["mtime"] != st.st_mtime or entry["bytes"] != st.st_size:
+            return None
+        return entry
+
+    def images(self):
+        """Entries for the files that are images."""
+        return {k: v for k, v in self.entries.items() if v.get("image") is not False}
@@ -0,0 +1,609 @@
+import math
+import os
+from fractions import Fraction
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFont
+from reportlab.lib.colors import CMYKColor, Color
+from reportlab.lib.utils import ImageReader
+
+# number of points used to approximate a full ellipse
+ARC_SEGMENTS = 72
+
+
+def multiply(m, n):
+    """Concatenate two PDF style affine matrices (a, b, c, d, e, f): m then n."""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (
+        a * A + b * C,
+        a * B + b * D,
+        c * A + d * C,
+        c * B + d * D,
+        e * A + f * C + E,
+        e * B + f * D + F,
+    )
+
+
+def applyMatrix(m, x, y):
+    a, b, c, d, e, f = m
+    return a * x + c * y + e, b * x + d * y + f
+
+
+def invertMatrix(m):
+    a, b, c, d, e, f = m
+    det = a * d - b * c
+    return (
+        d / det,
+        -b / det,
+        -c / det,
+        a / det,
+        (c * f - d * e) / det,
+        (b * e - a * f) / det,
+    )
+
+
+def toRGB(colour):
+    r, g, b = colour.rgb()
+    return (int(round(r * 255)), int(round(g * 255)), int(round(b * 255)))
+
+
+def imageSource(image):
+    """Return the PIL image or openable file behind a panel image."""
+    if isinstance(image, ImageReader):
+        if getattr(image, "_image", None) is not None:
+            return image._image
+        return image.fileName
+    return image
+
+
+def prepareImage(image, size):
+    """Convert a panel image to RGB and optional alpha arrays, downscaled to size.
+
+    Downscaling with a proper filter here avoids the aliasing the per-tile
+    bilinear sampling would otherwise produce on oversized artwork.
+    """
+    hasAlpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA" if hasAlpha else "RGB")
+    if size[0] < image.width or size[1] < image.height:
+        image = image.resize(
+            (min(size[0], image.width), min(size[1], image.height)),
+            PIL.Image.LANCZOS,
+            reducing_gap=3.0,
+        )
+    if hasAlpha:
+        image = image.convert("RGBA")
+        return np.asarray(image.convert("RGB")), np.asarray(image.getchannel("A"))
+    return np.asarray(image.convert("RGB")), None
+
+
+def sampleImage(rgb, alpha, toSource, left, top, width, height):
+    """Bilinearly sample an image at the centres of a block of page pixels.
+
+    Source coordinates are computed directly from each pixel's position on
+    the page, so a pixel gets the same value however the page is tiled.
+    Returns (colour, coverage) arrays, coverage being 0 outside the image.
+    """
+    a, b, c, d, e, f = toSource
+    xs = np.arange(left, left + width) + 0.5
+    ys = np.arange(top, top + height)[:, None] + 0.5
+    sx = a * xs + c * ys + e
+    sy = b * xs + d * ys + f
+    h, w = rgb.shape[:2]
+    coverage = ((sx >= 0) & (sx < w) & (sy >= 0) & (sy < h)).astype(np.float64)
+    fx = sx - 0.5
+    fy = sy - 0.5
+    x0 = np.floor(fx)
+    y0 = np.floor(fy)
+    wx = fx - x0
+    wy = fy - y0
+    x0 = x0.astype(np.intp)
+    y0 = y0.astype(np.intp)
+    x1 = np.clip(x0 + 1, 0, w - 1)
+    y1 = np.clip(y0 + 1, 0, h - 1)
+    x0 = np.clip(x0, 0, w - 1)
+    y0 = np.clip(y0, 0, h - 1)
+
+    def lerp(channel, wx, wy):
+        upper = channel[y0, x0] * (1 - wx) + channel[y0, x1] * wx
+        lower = channel[y1, x0] * (1 - wx) + channel[y1, x1] * wx
+        return upper * (1 - wy) + lower * wy
+
+    colour = lerp(rgb, wx[..., None], wy[..., None])
+    if alpha is not None:
+        coverage *= lerp(alpha, wx, wy) / 255.0
+    return colour, coverage
+
+
+def dashPolyline(points, dash):
+    """Split a user space polyline into its visible dash segments."""
+    if not dash:
+        return [points]
+    on, off = dash
+    period = float(on + off)
+    pieces = []
+    current = None
+    pos = 0.0
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        length = math.hypot(x1 - x0, y1 - y0)
+        t = 0.0
+        while t < length:
+            phase = pos % period
+            drawing = phase < on
+            remaining = (on if drawing else period) - phase
+            step = min(remaining, length - t)
+            if drawing and current is None:
+                current = [(x0 + (x1 - x0) * t / length, y0 + (y1 - y0) * t / length)]
+            t += step
+            pos += step
+            if drawing:
+                current.append(
+                    (x0 + (x1 - x0) * t / length, y0 + (y1 - y0) * t / length)
+                )
+                if step == remaining:
+                    pieces.append(current)
+                    current = None
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class RasterCanvas:
+    """Minimal stand-in for a reportlab canvas that renders to TIFF or PNG.
+
+    Drawing calls made by TuckBoxGenerator are recorded as a display list in
+    page points, with each panel image decoded once and downscaled to the
+    output resolution. save() then rasterises the page tile by tile on a
+    thread pool. TIFF output is written as a tiled TIFF, so only the tiles in
+    flight are held in memory; PNG stores scanlines, so one band of tiles
+    spanning the page width is held at a time.
+    """
+
+    def __init__(
+        self, filename, pagesize, dpi=600, fmt="tiff", tileSize=512, threads=None
+    ):
+        if fmt not in ("tiff", "png"):
+            raise ValueError("unsupported raster format {}".format(fmt))
+        if dpi <= 0:
+            raise ValueError("dpi must be positive, got {}".format(dpi))
+        if tileSize % 16:
+            raise ValueError("tileSize must be a multiple of 16")
+        self.filename = filename
+        self.pagesize = pagesize
+        self.dpi = dpi
+        self.format = fmt
+        self.tileSize = tileSize
+        self.threads = threads or os.cpu_count()
+        self.pixelsPerPoint = dpi / 72.0
+        self.ops = []
+        self._images = {}
+        self._state = {
+            "ctm": (1, 0, 0, 1, 0, 0),
+            "fill": (0, 0, 0),
+            "stroke": (0, 0, 0),
+            "dash": None,
+            "fontSize": 10,
+            "lineWidth": 1,
+        }
+        self._stack = []
+
+    # graphics state
+
+    def saveState(self):
+        self._stack.append(dict(self._state))
+
+    def restoreState(self):
+        self._state = self._stack.pop()
+
+    def _concat(self, m):
+        self._state["ctm"] = multiply(m, self._state["ctm"])
+
+    def translate(self, dx, dy):
+        self._concat((1, 0, 0, 1, dx, dy))
+
+    def scale(self, x, y):
+        self._concat((x, 0, 0, y, 0, 0))
+
+    def rotate(self, theta):
+        c = math.cos(math.radians(theta))
+        s = math.sin(math.radians(theta))
+        self._concat((c, s, -s, c, 0, 0))
+
+    def setDash(self, array=[], phase=0):
+        if isinstance(array, (int, float)):
+            self._state["dash"] = (array, phase)
+        elif array:
+            array = list(array)
+            self._state["dash"] = (array[0], array[-1])
+        else:
+            self._state["dash"] = None
+
+    def setLineWidth(self, width):
+        self._state["lineWidth"] = width
+
+    def setFontSize(self, size):
+        self._state["fontSize"] = size
+
+    def setFillColor(self, colour):
+        self._state["fill"] = toRGB(colour)
+
+    def setFillColorRGB(self, r, g, b):
+        self.setFillColor(Color(r, g, b))
+
+    def setFillColorCMYK(self, c, m, y, k):
+        self.setFillColor(CMYKColor(c, m, y, k))
+
+    def setStrokeColor(self, colour):
+        self._state["stroke"] = toRGB(colour)
+
+    def setStrokeColorRGB(self, r, g, b):
+        self.setStrokeColor(Color(r, g, b))
+
+    def setStrokeColorCMYK(self, c, m, y, k):
+        self.setStrokeColor(CMYKColor(c, m, y, k))
+
+    # recording
+
+    def _toPage(self, points):
+        ctm = self._state["ctm"]
+        return [applyMatrix(ctm, x, y) for x, y in points]
+
+    def _strokeWidth(self):
+        a, b, c, d, _, _ = self._state["ctm"]
+        return self._state["lineWidth"] * math.sqrt(abs(a * d - b * c))
+
+    def _addPath(self, points, stroke=True, fill=False, closed=False):
+        if fill:
+            self.ops.append(("polygon", self._toPage(points), self._state["fill"]))
+        if stroke:
+            if closed:
+                points = points + points[:1]
+            for piece in dashPolyline(points, self._state["dash"]):
+                self.ops.append(
+                    (
+                        "line",
+                        self._toPage(piece),
+                        self._state["stroke"],
+                        self._strokeWidth(),
+                    )
+                )
+
+    @staticmethod
+    def _arcPoints(x1, y1, x2, y2, startAng, extent):
+        cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        rx, ry = abs(x2 - x1) / 2.0, abs(y2 - y1) / 2.0
+        n = max(2, int(math.ceil(abs(extent) / 360.0 * ARC_SEGMENTS)))
+        return [
+            (
+                cx + rx * math.cos(math.radians(startAng + extent * i / n)),
+                cy + ry * math.sin(math.radians(startAng + extent * i / n)),
+            )
+            for i in range(n + 1)
+        ]
+
+    def line(self, x1, y1, x2, y2):
+        self._addPath([(x1, y1), (x2, y2)])
+
+    def rect(self, x, y, width, height, stroke=1, fill=0):
+        points = [(x, y), (x + width, y), (x + width, y + height), (x, y + height)]
+        self._addPath(points, stroke=stroke, fill=fill, closed=True)
+
+    def arc(self, x1, y1, x2, y2, startAng=0, extent=90):
+        self._addPath(self._arcPoints(x1, y1, x2, y2, startAng, extent))
+
+    def wedge(self, x1, y1, x2, y2, startAng, extent, stroke=1, fill=0):
+        centre = ((x1 + x2) / 2.0, (y1 + y2) / 2.0)
+        points = [centre] + self._arcPoints(x1, y1, x2, y2, startAng, extent)
+        self._addPath(points, stroke=stroke, fill=fill, closed=True)
+
+    def _pixelExtent(self, w, h):
+        """Device pixel lengths of the user space vectors (w, 0) and (0, h)."""
+        a, b, c, d, _, _ = self._state["ctm"]
+        return (
+            math.hypot(a * w, b * w) * self.pixelsPerPoint,
+            math.hypot(c * h, d * h) * self.pixelsPerPoint,
+        )
+
+    def _addImage(self, rgb, alpha, x, y, w, h):
+        # map image pixel space (y down) onto the user space box (y up)
+        ih, iw = rgb.shape[:2]
+        toUser = (w / float(iw), 0, 0, -h / float(ih), x, y + h)
+        toPixels = multiply(multiply(toUser, self._state["ctm"]), self._toPixels(0, 0))
+        corners = [
+            applyMatrix(toPixels, x, y) for x, y in ((0, 0), (iw, 0), (iw, ih), (0, ih))
+        ]
+        # page pixels whose centres can fall inside the image
+        bounds = (
+            int(math.floor(min(p[0] for p in corners))),
+            int(math.floor(min(p[1] for p in corners))),
+            int(math.ceil(max(p[0] for p in corners))),
+            int(math.ceil(max(p[1] for p in corners))),
+        )
+        self.ops.append(("image", rgb, alpha, invertMatrix(toPixels), bounds))
+
+    def drawImage(
+        self, image, x, y, width, height, preserveAspectRatio=False, mask=None
+    ):
+        source = imageSource(image)
+        if isinstance(source, PIL.Image.Image):
+            self._placeImage(
+                source, id(source), x, y, width, height, preserveAspectRatio
+            )
+        else:
+            key = source if isinstance(source, str) else id(source)
+            with PIL.Image.open(source) as opened:
+                self._placeImage(opened, key, x, y, width, height, preserveAspectRatio)
+
+    def _placeImage(self, image, key, x, y, width, height, preserveAspectRatio):
+        if preserveAspectRatio:
+            iw, ih = image.size
+            fit = min(width / float(iw), height / float(ih))
+            x += (width - iw * fit) / 2.0
+            y += (height - ih * fit) / 2.0
+            width, height = iw * fit, ih * fit
+        size = tuple(
+            max(1, int(math.ceil(n))) for n in self._pixelExtent(width, height)
+        )
+        # the same artwork placed at the same size is only decoded once
+        if (key, size) not in self._images:
+            self._images[key, size] = prepareImage(image, size)
+        prepared, alpha = self._images[key, size]
+        self._addImage(prepared, alpha, x, y, width, height)
+
+    def drawCentredString(self, x, y, text):
+        a, b, c, d, _, _ = self._state["ctm"]
+        pixelsPerUnit = self.pixelsPerPoint * math.sqrt(abs(a * d - b * c))
+        font = PIL.ImageFont.load_default(
+            size=max(1, int(round(self._state["fontSize"] * pixelsPerUnit)))
+        )
+        left, top, right, bottom = font.getbbox(text, anchor="ls")
+        if right <= left or bottom <= top:
+            return
+        mask = PIL.Image.new("L", (right - left, bottom - top), 0)
+        PIL.ImageDraw.Draw(mask).text(
+            (-left, -top), text, fill=255, font=font, anchor="ls"
+        )
+        colour = np.empty((mask.height, mask.width, 3), np.uint8)
+        colour[...] = self._state["fill"]
+        advance = font.getlength(text) / pixelsPerUnit
+        self._addImage(
+            colour,
+            np.asarray(mask),
+            x - advance / 2.0 + left / pixelsPerUnit,
+            y - bottom / pixelsPerUnit,
+            (right - left) / pixelsPerUnit,
+            (bottom - top) / pixelsPerUnit,
+        )
+
+    # rendering
+
+    def _pixelSize(self):
+        return (
+            int(round(self.pagesize[0] * self.pixelsPerPoint)),
+            int(round(self.pagesize[1] * self.pixelsPerPoint)),
+        )
+
+    def _toPixels(self, left, top):
+        """Matrix taking page points to pixels of a tile with the given origin."""
+        return (
+            self.pixelsPerPoint,
+            0,
+            0,
+            -self.pixelsPerPoint,
+            -left,
+            self.pagesize[1] * self.pixelsPerPoint - top,
+        )
+
+    def _strokeMargin(self):
+        """Pixels of overdraw needed around a tile to hide stroke clipping."""
+        widths = [op[3] for op in self.ops if op[0] == "line"]
+        return int(math.ceil(max(widths or [0]) * self.pixelsPerPoint)) + 2
+
+    def renderTile(self, left, top, width, height, margin=0):
+        """Render one tile of the page.
+
+        The tile is drawn with margin extra pixels on every side and cropped,
+        so wide strokes are never clipped by PIL right at the tile edge.
+        """
+        left -= margin
+        top -= margin
+        size = (width + 2 * margin, height + 2 * margin)
+        tile = PIL.Image.new("RGB", size, (255, 255, 255))
+        draw = PIL.ImageDraw.Draw(tile)
+        toPixels = self._toPixels(left, top)
+        for op in self.ops:
+            kind = op[0]
+            if kind == "image":
+                self._renderImage(tile, left, top, *op[1:])
+                continue
+            # snap to whole pixels so every tile rasterises an edge identically
+            points = [
+                tuple(int(math.floor(n + 0.5)) for n in applyMatrix(toPixels, x, y))
+                for x, y in op[1]
+            ]
+            xs = [p[0] for p in points]
+            ys = [p[1] for p in points]
+            pad = op[3] * self.pixelsPerPoint if kind == "line" else 0
+            if (
+                max(xs) + pad < 0
+                or min(xs) - pad > size[0]
+                or max(ys) + pad < 0
+                or min(ys) - pad > size[1]
+            ):
+                continue
+            if kind == "polygon":
+                draw.polygon(points, fill=op[2])
+            else:
+                draw.line(points, fill=op[2], width=max(1, int(round(pad))))
+        if margin:
+            tile = tile.crop((margin, margin, margin + width, margin + height))
+        return tile
+
+    @staticmethod
+    def _renderImage(tile, left, top, rgb, alpha, toSource, bounds):
+        # resample only the part of the image covered by this tile
+        x0 = max(left, bounds[0])
+        y0 = max(top, bounds[1])
+        x1 = min(left + tile.width, bounds[2])
+        y1 = min(top + tile.height, bounds[3])
+        if x1 <= x0 or y1 <= y0:
+            return
+        colour, coverage = sampleImage(rgb, alpha, toSource, x0, y0, x1 - x0, y1 - y0)
+        box = (x0 - left, y0 - top, x1 - left, y1 - top)
+        coverage = coverage[..., None]
+        under = np.asarray(tile.crop(box), np.float64)
+        blended = np.floor(colour * coverage + under * (1 - coverage) + 0.5)
+        tile.paste(PIL.Image.fromarray(blended.astype(np.uint8)), box[:2])
+
+    def save(self):
+        width, height = self._pixelSize()
+        if self.format == "tiff":
+            writer = TIFFWriter(self.filename, width, height, self.dpi, self.tileSize)
+        else:
+            writer = PNGWriter(self.filename, width, height, self.dpi)
+        margin = self._strokeMargin()
+        try:
+            with ThreadPoolExecutor(self.threads) as pool:
+                if self.format == "tiff":
+                    self._saveTiles(pool, writer, width, height, margin)
+                else:
+                    self._saveBands(pool, writer, width, height, margin)
+        finally:
+            writer.close()
+
+    def _saveTiles(self, pool, writer, width, height, margin):
+        size = self.tileSize
+        origins = [
+            (left, top)
+            for top in range(0, height, size)
+            for left in range(0, width, size)
+        ]
+        # render a pool's worth of tiles at a time to bound what is in flight
+        for i in range(0, len(origins), self.threads):
+            tiles = pool.map(
+                lambda origin: self.renderTile(
+                    origin[0], origin[1], size, size, margin
+                ),
+                origins[i : i + self.threads],
+            )
+            for tile in tiles:
+                writer.writeTile(tile.tobytes())
+
+    def _saveBands(self, pool, writer, width, height, margin):
+        size = self.tileSize
+        lefts = range(0, width, size)
+        for top in range(0, height, size):
+            bandHeight = min(size, height - top)
+            tiles = list(
+                pool.map(
+                    lambda left: self.renderTile(
+                        left, top, min(size, width - left), bandHeight, margin
+                    ).tobytes(),
+                    lefts,
+                )
+            )
+            rowBytes = [min(size, width - left) * 3 for left in lefts]
+            for y in range(bandHeight):
+                writer.writeRow(
+                    b"".join(
+                        data[y * n : (y + 1) * n] for data, n in zip(tiles, rowBytes)
+                    )
+                )
+
+
+class PNGWriter:
+    """Writes an RGB PNG one band of scanlines at a time."""
+
+    def __init__(self, filename, width, height, dpi):
+        self.file = open(filename, "wb")
+        self.compressor = zlib.compressobj()
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        perMetre = int(round(dpi / 0.0254))
+        self._chunk(b"pHYs", struct.pack(">IIB", perMetre, perMetre, 1))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def writeRow(self, row):
+        compressed = self.compressor.compress(b"\x00" + row)
+        if compressed:
+            self._chunk(b"IDAT", compressed)
+
+    def close(self):
+        self._chunk(b"IDAT", self.compressor.flush())
+        self._chunk(b"IEND", b"")
+        self.file.close()
+
+
+class TIFFWriter:
+    """Writes a deflate compressed, tiled RGB TIFF one tile at a time."""
+
+    def __init__(self, filename, width, height, dpi, tileSize):
+        self.file = open(filename, "wb")
+        self.width = width
+        self.height = height
+        self.dpi = Fraction(dpi).limit_denominator(1000)
+        self.tileSize = tileSize
+        self.offsets = []
+        self.counts = []
+        # header; the IFD offset is patched in on close
+        self.file.write(b"II*\x00\x00\x00\x00\x00")
+
+    def writeTile(self, data):
+        compressed = zlib.compress(data)
+        self.offsets.append(self.file.tell())
+        self.counts.append(len(compressed))
+        self.file.write(compressed)
+
+    def _align(self):
+        if self.file.tell() % 2:
+            self.file.write(b"\x00")
+        return self.file.tell()
+
+    def _longs(self, values):
+        if len(values) == 1:
+            return values[0]
+        offset = self._align()
+        self.file.write(struct.pack("<{}I".format(len(values)), *values))
+        return offset
+
+    def close(self):
+        tileOffsets = self._longs(self.offsets)
+        tileCounts = self._longs(self.counts)
+        bitsPerSample = self._align()
+        self.file.write(struct.pack("<3H", 8, 8, 8))
+        resolution = self._align()
+        self.file.write(struct.pack("<II", self.dpi.numerator, self.dpi.denominator))
+        SHORT, LONG, RATIONAL = 3, 4, 5
+        entries = [
+            (256, LONG, 1, self.width),
+            (257, LONG, 1, self.height),
+            (258, SHORT, 3, bitsPerSample),
+            (259, SHORT, 1, 8),  # adobe deflate
+            (262, SHORT, 1, 2),  # RGB
+            (277, SHORT, 1, 3),
+            (282, RATIONAL, 1, resolution),
+            (283, RATIONAL, 1, resolution),
+            (296, SHORT, 1, 2),  # inches
+            (322, LONG, 1, self.tileSize),
+            (323, LONG, 1, self.tileSize),
+            (324, LONG, len(self.offsets), tileOffsets),
+            (325, LONG, len(self.counts), tileCounts),
+        ]
+        ifd = self._align()
+        self.file.write(struct.pack("<H", len(entries)))
+        for tag, kind, count, value in entries:
+            self.file.write(struct.pack("<HHII", tag, kind, count, value))
+        self.file.write(struct.pack("<I", 0))
+        self.file.seek(4)
+        self.file.write(struct.pack("<I", ifd))
+        self.file.close()
@@ -1,3 +1,6 @@
+import os
+from collections import namedtuple
+
 import reportlab.pdfgen.canvas as pdfgcanvas
 from reportlab.lib.pagesizes import LETTER, landscape, A4
 from reportlab.lib.units import cm
@@ -6,6 +9,25 @@ from reportlab.lib.colors import HexColor
 import PIL
 import click
 
+if __package__:
+    from tuckboxes.assets import AssetIndex
+    from tuckboxes.raster import RasterCanvas, imageSource
+else:
+    # run as a script: the tuckboxes/ directory itself is on sys.path, where
+    # "tuckboxes" resolves to this module rather than to the package
+    from assets import AssetIndex
+    from raster import RasterCanvas, imageSource
+
+RASTER_EXTENSIONS = {"tiff": (".tif", ".tiff"), "png": (".png",)}
+
+PanelResolution = namedtuple("PanelResolution", ["panel", "path", "dpi", "error"])
+
+
+def imagePath(image):
+    """Best effort file path for a panel image given as a path or ImageReader."""
+    source = imageSource(image)
+    return getattr(source, "filename", source) or None
+
 
 class TuckBoxGenerator:
     def __init__(
@@ -25,6 +47,8 @@ class TuckBoxGenerator:
         endVerticalMargin=0,
         endHorizontalMargin=0,
         canvas=None,
+        outputFormat="pdf",
+        dpi=600,
     ):
         self.pagesize = landscape(pagesize)
         self.canvas = canvas
@@ -45,6 +69,8 @@ class TuckBoxGenerator:
         self.endVerticalMargin = endVerticalMargin
         self.endHorizontalMargin = endHorizontalMargin
         self.is_sample = False
+        self.outputFormat = outputFormat
+        self.dpi = dpi
 
     @staticmethod
     def fromRawData(
@@ -60,6 +86,8 @@ class TuckBoxGenerator:
         preserveSideAspect=False,
         preserveEndAspect=False,
         pagesize="letter",
+        outputFormat="pdf",
+        dpi=600,
     ):
         fImRead = ImageReader(PIL.Image.open(fIm)) if fIm else None
         sImRead = ImageReader(PIL.Image.open(sIm)) if sIm else None
@@ -82,6 +110,8 @@ class TuckBoxGenerator:
             preserveSideAspect=preserveSideAspect,
             preserveEndAspect=preserveEndAspect,
             pagesize=ps,
+            outputFormat=outputFormat,
+            dpi=dpi,
         )
 
     def drawImage(self, image, x, y, w, h, preserveAspect, tag):
@@ -325,13 +355,58 @@ class TuckBoxGenerator:
         )
         self.canvas.restoreState()
 
+    def preflight(self, index):
+        """Report the effective DPI of each panel image using an AssetIndex.
+
+        Works from the indexed image headers only, so no pixels are decoded.
+        """
+        placements = [
+            ("Front", self.frontImage, self.height, self.width, False),
+            ("Back", self.backImage, self.height, self.width, False),
+            ("Side", self.sideImage, self.height, self.depth, self.preserveSideAspect),
+            (
+                "End",
+                self.endImage,
+                self.width - self.endHorizontalMargin,
+                self.depth - 2 * self.endVerticalMargin,
+                self.preserveEndAspect,
+            ),
+        ]
+        report = []
+        for panel, image, w, h, preserveAspect in placements:
+            if not image:
+                continue
+            path = imagePath(image)
+            entry = index.lookup(path) if isinstance(path, str) else None
+            if entry is None:
+                report.append(
+                    PanelResolution(panel, path, None, "not indexed or stale")
+                )
+            elif "error" in entry:
+                report.append(PanelResolution(panel, path, None, entry["error"]))
+            else:
+                xDpi = entry["width"] * 72.0 / w
+                yDpi = entry["height"] * 72.0 / h
+                # preserving aspect fits the image inside the panel
+                dpi = max(xDpi, yDpi) if preserveAspect else min(xDpi, yDpi)
+                report.append(PanelResolution(panel, path, dpi, None))
+        return report
+
     def generate(self):
         if self.filename:
             print("generating {}".format(self.filename))
 
         if self.canvas is None:
             assert self.filename
-            self.canvas = pdfgcanvas.Canvas(self.filename, pagesize=self.pagesize)
+            if self.outputFormat == "pdf":
+                self.canvas = pdfgcanvas.Canvas(self.filename, pagesize=self.pagesize)
+            else:
+                self.canvas = RasterCanvas(
+                    self.filename,
+                    pagesize=self.pagesize,
+                    dpi=self.dpi,
+                    fmt=self.outputFormat,
+                )
         self.canvas.saveState()
         self.canvas.translate(self.pageMargin, self.pageMargin)
 
@@ -422,11 +497,11 @@ class TuckBoxGenerator:
             return sample_out.getvalue()
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option("--width", default=6.4, help="width in centimers")
 @click.option("--height", default=8.8, help="height in centimers")
 @click.option("--depth", default=3.0, help="depth in centimers")
-@click.option("--outfile", default="tuckbox.pdf")
+@click.option("--outfile", help="defaults to tuckbox.<format>")
 @click.option("--front_image", help="file path")
 @click.option("--back_image", help="file path")
 @click.option("--side_image", help="file path")
@@ -434,7 +509,24 @@ class TuckBoxGenerator:
 @click.option("--preserve_end_aspect", default=False)
 @click.option("--preserve_side_aspect", default=False)
 @click.option("--fill_colour", default="#FFFFFF", help="RGB hex string for side/end background colour")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["pdf", "tiff", "png"]),
+    default="pdf",
+    help="output file format",
+)
+@click.option(
+    "--dpi",
+    default=600,
+    type=click.FloatRange(min=0, min_open=True),
+    help="resolution for tiff/png output",
+)
+@click.option("--asset_index", help="asset directory indexed with 'tuckboxes index'")
+@click.option("--min_dpi", default=300, help="lowest acceptable effective panel DPI")
+@click.pass_context
 def main(
+    ctx,
     width,
     height,
     depth,
@@ -446,7 +538,23 @@ def main(
     preserve_end_aspect,
     preserve_side_aspect,
     fill_colour,
+    output_format,
+    dpi,
+    asset_index,
+    min_dpi,
 ):
+    if ctx.invoked_subcommand is not None:
+        return
+    if outfile is None:
+        outfile = "tuckbox.{}".format(output_format)
+    elif (
+        output_format in RASTER_EXTENSIONS
+        and os.path.splitext(outfile)[1].lower() not in RASTER_EXTENSIONS[output_format]
+    ):
+        raise click.BadParameter(
+            "{} does not match --format {}".format(outfile, output_format),
+            param_hint="--outfile",
+        )
     tuck = TuckBoxGenerator(
         width * cm,
         height * cm,
@@ -459,11 +567,38 @@ def main(
         preserveEndAspect=preserve_end_aspect,
         preserveSideAspect=preserve_side_aspect,
         fillColour=fill_colour,
+        outputFormat=output_format,
+        dpi=dpi,
     )
+    if asset_index:
+        failed = False
+        for panel in tuck.preflight(AssetIndex.load(asset_index)):
+            if panel.error:
+                print("{}: {} {}".format(panel.panel, panel.path, panel.error))
+                failed = True
+            else:
+                print("{}: {} {:.0f} dpi".format(panel.panel, panel.path, panel.dpi))
+                failed = failed or panel.dpi < min_dpi
+        if failed:
+            raise click.ClickException("preflight failed")
     tuck.generate()
     tuck.close()
 
 
+@main.command()
+@click.argument("asset_dir", type=click.Path(exists=True, file_okay=False))
+def index(asset_dir):
+    """Index image headers below ASSET_DIR for preflight checks."""
+    assets = AssetIndex.load(asset_dir)
+    scanned, removed = assets.update()
+    assets.save()
+    print(
+        "indexed {} images ({} scanned, {} removed)".format(
+            len(assets.images()), scanned, removed
+        )
+    )
+
+
 def sample():
     tuck = TuckBoxGenerator(
         6.7 * cm,